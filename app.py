@@ -1,14 +1,74 @@
 import os
-import requests
 import time
-from flask import Flask, jsonify, request
+import logging
+import math
+import asyncio
+import httpx
+import requests
+import threading
+import hashlib
+import secrets
+import gzip
+import redis
+from collections import defaultdict, namedtuple
+from typing import Any
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, request
 from flask_cors import CORS
+from flask_caching import Cache
+from flask_compress import Compress
 from dotenv import load_dotenv
 
+# Fastest installed JSON backend wins (orjson, then simdjson for parsing, then stdlib);
+# every tier produces the same bytes shape
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj):
+        # OPT_NON_STR_KEYS: the stats 'distribution' uses int keys, as stdlib json allows
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    import json
+
+    try:
+        # Drop-in for json.loads that parses with SIMD, used if pysimdjson happens to be installed; it has no encoder
+        from simdjson import loads as json_loads
+    except ImportError:
+        json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+# Optional: compact int8 rating arrays and vectorized histograms for large review sets
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Optional typed decoder for review pages: it skips unknown fields while parsing
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
 # 1. Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+# Level-gated and %-formatted, so disabled messages cost neither formatting nor stdout writes
+LOG_LEVEL = (os.getenv('LOG_LEVEL') or 'INFO').upper()
+# getLevelName maps known names to their number; an unknown one would make basicConfig raise at import
+LOG_LEVEL_VALID = isinstance(logging.getLevelName(LOG_LEVEL), int)
+logging.basicConfig(level=LOG_LEVEL if LOG_LEVEL_VALID else logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+# httpx logs every request URL at INFO, and Judge.me URLs carry the API token
+logging.getLogger('httpx').setLevel(logging.WARNING)
+log = logging.getLogger(__name__)
+if not LOG_LEVEL_VALID:
+    log.warning("Unknown LOG_LEVEL %r, using INFO", LOG_LEVEL)
 
 # --- CORS CONFIGURATION ---
 # Allows your Shopify store domains to communicate with this backend
@@ -25,9 +85,19 @@ CORS(app, resources={r"/api/*": {
     "allow_headers": ["Content-Type"]
 }})
 
+# --- RESPONSE COMPRESSION ---
+# Review lists are large, repetitive JSON: gzip/br cuts the storefront download several-fold
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
+
 # Credentials and IDs from .env
 API_TOKEN = os.getenv('JUDGE_ME_API_TOKEN')
 SHOP_DOMAIN = os.getenv('SHOP_DOMAIN')
+# Optional Redis for the shared review cache and the cross-worker refresh lock
+REDIS_URL = os.getenv('REDIS_URL')
+# Shared secret for POST /api/_invalidate (sent as X-Invalidate-Token); unset disables the route
+INVALIDATE_TOKEN = os.getenv('INVALIDATE_TOKEN')
 # This is the External ID: 9972195066142
 VERSION_H1_ID = os.getenv('PRODUCT_ID_VERSION_H1')
 
@@ -40,57 +110,671 @@ PRODUCT_ID_MAP = {
     "version-h1": VERSION_H1_ID 
 }
 
+# --- CONFIGURATION: REVIEW DISPLAY ---
+# Judge.me 'verified' values that earn the verified badge
+VERIFIED_SET = frozenset({'buyer', 'verified_buyer', 'confirmed-buyer', 'verified-purchase', 'email'})
+# Author names replaced with "Verified Buyer"
+ANON_TOKENS = frozenset({'anonymous', ''})
+
+# --- HTTP SESSION ---
+# One pooled keep-alive session so paginated calls reuse the TLS connection
+JUDGEME_API = "https://judge.me/api/v1"
+JUDGEME_HEADERS = {
+    'User-Agent': 'armor-judgeme/1.0',
+    'Accept': 'application/json',
+    # Set explicitly; br decoding comes from the brotli package Flask-Compress installs
+    'Accept-Encoding': 'gzip, deflate, br'
+}
+
+# Rate limits and transient gateway errors are retried with exponential backoff (Retry-After wins)
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.3
+
+# Connect timeout just above the 3s TCP retransmission window; read timeout for slow pages
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+
+SESSION = requests.Session()
+SESSION.headers.update(JUDGEME_HEADERS)
+# POST is left out of allowed_methods: replaying a submission after a 5xx could post the review twice
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        allowed_methods=frozenset({'GET'})
+    )
+))
+
+class TokenBucket:
+    """Thread-safe token bucket: reserve() books a token and returns the seconds to wait for it"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going negative queues the caller behind everyone already waiting
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self):
+        """Books a token without waiting for it; the debt delays later reserve() callers instead"""
+        self.reserve()
+
+# Every Judge.me call takes a token, so concurrent fetches run flat out up to the API ceiling but not past it.
+# JUDGEME_RPS is the budget for the whole deployment. With Redis, the refresh lock lets only one worker
+# paginate at a time, so it gets the full budget; without it, each WEB_CONCURRENCY worker paginates and gets a share
+JUDGEME_WORKERS = 1 if REDIS_URL else max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+JUDGEME_RATE_LIMIT = TokenBucket(float(os.getenv('JUDGEME_RPS', '5')) / JUDGEME_WORKERS)
+
+# Failures worth reporting as a bad upstream rather than a server bug
+UPSTREAM_ERRORS = (requests.RequestException, httpx.HTTPError, ValueError)
+
 # --- HELPER FUNCTIONS ---
 
+PER_PAGE = 100
+# Extra pages requested per wave when the review count is unknown or stale
+FETCH_WAVE_SIZE = 8
+# Caps in-flight Judge.me requests on the shared HTTP/2 connection (JUDGEME_CONCURRENCY)
+JUDGEME_MAX_IN_FLIGHT = int(os.getenv('JUDGEME_CONCURRENCY', '8'))
+
+# Query strings that never change between pages, encoded once; only '&page=N' is appended per call
+SHOP_QUERY = urlencode({'api_token': API_TOKEN or '', 'shop_domain': SHOP_DOMAIN or ''})
+REVIEWS_PAGE_URL = f"{JUDGEME_API}/reviews?{SHOP_QUERY}&per_page={PER_PAGE}"
+REVIEWS_COUNT_URL = f"{JUDGEME_API}/reviews/count?{SHOP_QUERY}"
+
+# Product handle -> Judge.me product id, resolved on demand (only successful lookups are kept)
+JUDGEME_PRODUCT_IDS = {}
+# Handles Judge.me didn't resolve. Once this many distinct handles have missed, cold requests for new
+# ones skip the lookup and wait for the full snapshot, so random ?handle= values can't spend the API budget
+JUDGEME_UNKNOWN_HANDLES = set()
+UNKNOWN_HANDLES_MAX = 256
+
+# Compact ingest record: only what indexing, stats and the storefront read, so the raw
+# Judge.me objects (with their many picture size variants) are garbage right after decoding
+Review = namedtuple('Review', 'id product_handle published rating author is_verified body created_at media')
+
+def clamp_rating(value):
+    """Rating as an int in 1..5; anything unparseable counts as 5, like a missing rating"""
+    if type(value) is not int:
+        # Normalized once at ingest, so stats and rendering never re-validate; junk can't fail the page
+        try:
+            value = int(value) if isinstance(value, (float, str)) else 5
+        except (ValueError, OverflowError):
+            # Unparseable strings ('--3', '²'), NaN and infinity
+            value = 5
+    return 1 if value < 1 else 5 if value > 5 else value
+
+def _pic_url(p):
+    """Best display URL for a Judge.me picture"""
+    u = p.get('urls')
+    return (u.get('original') or u.get('huge')) if isinstance(u, dict) else p.get('url')
+
+# Serializes as [] like an empty list
+EMPTY_MEDIA = ()
+
+def review_media(pictures, videos):
+    """Storefront media entries for a review's raw pictures and videos"""
+    if not isinstance(pictures, list):
+        pictures = ()
+    if not isinstance(videos, list):
+        videos = ()
+    if not pictures and not videos:
+        # Most reviews have no media: share one empty tuple instead of allocating a list each
+        return EMPTY_MEDIA
+    # null or malformed entries are skipped rather than failing the whole page
+    media = [
+        {"type": "image", "url": u}
+        for p in pictures if isinstance(p, dict) and (u := _pic_url(p))
+    ]
+    media += [
+        {"type": "video", "url": u}
+        for v in videos if isinstance(v, dict) and (u := v.get('url') or v.get('original_url'))
+    ]
+    return media
+
+def display_author(user_name, reviewer):
+    """Name shown on the storefront"""
+    reviewer_name = reviewer.get('name') if isinstance(reviewer, dict) else None
+    # FIX: Prioritize raw 'user_name' to prevent initials (e.g. 'I.Y') from showing 
+    author_name = next((n for n in (user_name, reviewer_name) if n and isinstance(n, str)), 'Verified Buyer')
+    if author_name.strip().lower() in ANON_TOKENS:
+        author_name = "Verified Buyer"
+    return author_name
+
+def build_review(review_id, handle, published, rating, user_name, reviewer, verified, body, created_at, pictures, videos):
+    """Normalizes raw Judge.me field values into a Review; odd values degrade per field instead of raising"""
+    return Review(
+        review_id, handle if isinstance(handle, str) else None, published is True,
+        clamp_rating(rating), display_author(user_name, reviewer),
+        isinstance(verified, str) and verified in VERIFIED_SET, body, created_at,
+        review_media(pictures, videos)
+    )
+
+def project_review(r):
+    """Builds a Review from a raw Judge.me review dict"""
+    r_get = r.get
+    return build_review(
+        r_get('id'), r_get('product_handle'), r_get('published'), r_get('rating'), r_get('user_name'),
+        r_get('reviewer'), r_get('verified'), r_get('body'), r_get('created_at'), r_get('pictures'), r_get('videos')
+    )
+
+if msgspec is not None:
+    class JudgemeReview(msgspec.Struct):
+        """The raw review fields a Review is built from; everything else is skipped by the decoder.
+
+        Untyped on purpose: build_review normalizes each value, so one odd field degrades that
+        field instead of failing validation for the whole page.
+        """
+        id: Any = None
+        product_handle: Any = None
+        published: Any = None
+        rating: Any = None
+        verified: Any = None
+        user_name: Any = None
+        reviewer: Any = None
+        body: Any = None
+        created_at: Any = None
+        pictures: Any = None
+        videos: Any = None
+
+        def to_review(self):
+            # Attribute reads: no per-field dict lookups
+            return build_review(
+                self.id, self.product_handle, self.published, self.rating, self.user_name,
+                self.reviewer, self.verified, self.body, self.created_at, self.pictures, self.videos
+            )
+
+    class JudgemeReviewsPage(msgspec.Struct):
+        # null (like a missing key) ends pagination, as on the dict path
+        reviews: list[JudgemeReview | None] | None = None
+
+    REVIEWS_PAGE_DECODER = msgspec.json.Decoder(JudgemeReviewsPage)
+
+def decode_reviews_page(content):
+    """Decodes a Judge.me reviews page into a list of Review records"""
+    if msgspec is not None:
+        try:
+            page = REVIEWS_PAGE_DECODER.decode(content)
+        except msgspec.ValidationError:
+            # e.g. a non-object row: redo the page as dicts below, which skips just that row
+            pass
+        else:
+            return [r.to_review() for r in page.reviews or () if r is not None]
+    # Without msgspec, json_loads is orjson (or simdjson.loads); both beat lazily projecting off a
+    # simdjson document, whose per-field proxy reads were slower even than stdlib json here
+    page = json_loads(content)
+    if not isinstance(page, dict):
+        raise ValueError("Judge.me reviews page is not an object")
+    return [project_review(r) for r in page.get('reviews') or () if isinstance(r, dict)]
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number `attempt` (0-based), preferring Judge.me's Retry-After"""
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return RETRY_BACKOFF * (2 ** attempt)
+
+async def fetch_reviews_page_async(client, slots, page_url, page):
+    """Fetches one page of raw reviews, retrying rate limits and transient errors; raises on failure"""
+    url = f"{page_url}&page={page}"
+    try:
+        for attempt in range(RETRY_TOTAL + 1):
+            try:
+                # Booked inside the slot, so a paginate never has more than JUDGEME_MAX_IN_FLIGHT tokens reserved
+                async with slots:
+                    await asyncio.sleep(JUDGEME_RATE_LIMIT.reserve())
+                    res = await client.get(url)
+                if res.status_code not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+                    break
+                delay = retry_delay(attempt, res.headers.get('Retry-After'))
+            except httpx.TransportError:
+                if attempt == RETRY_TOTAL:
+                    raise
+                delay = retry_delay(attempt)
+            await asyncio.sleep(delay)
+        res.raise_for_status()
+        return decode_reviews_page(res.content)
+    except UPSTREAM_ERRORS as e:
+        # Not the message itself: httpx errors embed the URL, which carries the API token
+        log.error("Judge.me reviews page %d failed (%s)", page, type(e).__name__)
+        raise
+
+async def fetch_review_count_async(client, slots, count_url):
+    """Returns the total review count, or 0 if there is no count URL or Judge.me doesn't report it"""
+    if not count_url:
+        return 0
+    try:
+        async with slots:
+            await asyncio.sleep(JUDGEME_RATE_LIMIT.reserve())
+            res = await client.get(count_url)
+        if res.status_code != 200: return 0
+        return int(json_loads(res.content).get('count') or 0)
+    except UPSTREAM_ERRORS:
+        return 0
+
+async def paginate_reviews_async(client, page_url, count_url=None):
+    """Fetches every page of `page_url` concurrently over one multiplexed HTTP/2 connection"""
+    slots = asyncio.Semaphore(JUDGEME_MAX_IN_FLIGHT)
+    first_batch, total = await asyncio.gather(
+        fetch_reviews_page_async(client, slots, page_url, 1),
+        fetch_review_count_async(client, slots, count_url)
+    )
+    if not first_batch: return []
+    all_reviews = list(first_batch)
+    if len(first_batch) < PER_PAGE: return all_reviews
+
+    # Request every remaining page at once; fall back to waves if the count is unknown or stale
+    next_page = 2
+    last_page = math.ceil(total / PER_PAGE)
+    while True:
+        if last_page < next_page:
+            last_page = next_page + FETCH_WAVE_SIZE - 1
+        batches = await asyncio.gather(*[
+            fetch_reviews_page_async(client, slots, page_url, p) for p in range(next_page, last_page + 1)
+        ])
+        for current_batch in batches:
+            if not current_batch:
+                return all_reviews
+            all_reviews.extend(current_batch)
+            if len(current_batch) < PER_PAGE:
+                return all_reviews
+        next_page = last_page + 1
+
+# One long-lived event loop and HTTP/2 client for every Judge.me fetch,
+# so the multiplexed TLS connection is reused across refreshes and cold-path requests
+JUDGEME_LOOP = None
+JUDGEME_CLIENT = None
+JUDGEME_LOOP_LOCK = threading.Lock()
+
+def judgeme_client():
+    """Returns the shared AsyncClient; only ever called on JUDGEME_LOOP"""
+    global JUDGEME_CLIENT
+    if JUDGEME_CLIENT is None:
+        JUDGEME_CLIENT = httpx.AsyncClient(
+            http2=True,
+            headers=JUDGEME_HEADERS,
+            limits=httpx.Limits(max_keepalive_connections=10),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+    return JUDGEME_CLIENT
+
+async def fetch_all_shop_reviews_async():
+    """Fetches every review in the shop"""
+    return await paginate_reviews_async(judgeme_client(), REVIEWS_PAGE_URL, REVIEWS_COUNT_URL)
+
+async def fetch_product_reviews_async(handle):
+    """Fetches only one product's reviews; returns None if Judge.me doesn't know the handle"""
+    client = judgeme_client()
+    product_id = JUDGEME_PRODUCT_IDS.get(handle)
+    if product_id is None:
+        if handle in JUDGEME_UNKNOWN_HANDLES or len(JUDGEME_UNKNOWN_HANDLES) >= UNKNOWN_HANDLES_MAX:
+            return None
+        # Judge.me looks products up by handle when the id is -1
+        await asyncio.sleep(JUDGEME_RATE_LIMIT.reserve())
+        res = await client.get(f"{JUDGEME_API}/products/-1?{SHOP_QUERY}&{urlencode({'handle': handle})}")
+        if res.status_code == 404:
+            JUDGEME_UNKNOWN_HANDLES.add(handle)
+        if res.status_code != 200: return None
+        product_id = (json_loads(res.content).get('product') or {}).get('id')
+        if not product_id:
+            JUDGEME_UNKNOWN_HANDLES.add(handle)
+            return None
+        JUDGEME_PRODUCT_IDS[handle] = product_id
+    return await paginate_reviews_async(client, f"{REVIEWS_PAGE_URL}&product_id={product_id}")
+
+def judgeme_event_loop():
+    """Returns the Judge.me event loop, starting it on a daemon thread on first use (per worker process).
+
+    Under gevent's monkey patching that thread is a greenlet; the loop's patched selector yields to the
+    hub, and it's the only loop in the OS thread, so it never clashes with another running loop.
+    """
+    global JUDGEME_LOOP
+    with JUDGEME_LOOP_LOCK:
+        if JUDGEME_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='judgeme-io', daemon=True).start()
+            JUDGEME_LOOP = loop
+    return JUDGEME_LOOP
+
+def run_async(coro):
+    """Runs a coroutine on the Judge.me event loop and waits for its result from sync code"""
+    return asyncio.run_coroutine_threadsafe(coro, judgeme_event_loop()).result()
+
 def fetch_all_shop_reviews():
-    """Fetches raw reviews from Judge.me API [cite: 63]"""
-    url = "https://judge.me/api/v1/reviews"
-    all_reviews = []
-    page = 1
-    per_page = 100 
-    
+    """Fetches raw reviews from Judge.me API [cite: 63]; raises instead of returning a partial list"""
+    return run_async(fetch_all_shop_reviews_async())
+
+def fetch_product_reviews(handle):
+    """Fetches one product's raw reviews (None if the handle can't be resolved); raises on fetch failure"""
+    return run_async(fetch_product_reviews_async(handle))
+
+# --- REVIEW CACHE ---
+# Stale-while-revalidate: requests always read the last snapshot, a background thread refreshes it
+# Seconds a snapshot stays fresh (REVIEWS_CACHE_TTL); the shared Redis copy expires on the same clock
+REVIEWS_REFRESH_INTERVAL = int(os.getenv('REVIEWS_CACHE_TTL', '45'))
+# /healthz reports the cache as stale after several missed refreshes
+REVIEWS_STALE_AFTER = 4 * REVIEWS_REFRESH_INTERVAL
+# Storefront clients revalidate with If-None-Match after this
+REVIEWS_CACHE_CONTROL = 'public, max-age=30'
+
+# Shared second tier (Redis) so new workers and cold starts skip the full paginate
+cache = Cache(app, config={
+    'CACHE_TYPE': 'RedisCache' if REDIS_URL else 'NullCache',
+    'CACHE_REDIS_URL': REDIS_URL,
+    'CACHE_DEFAULT_TIMEOUT': REVIEWS_REFRESH_INTERVAL,
+    'CACHE_NO_NULL_WARNING': True
+})
+# Bump the version whenever the stored row layout (Review fields) changes
+SHARED_REVIEWS_KEY = f'reviews:v2:{SHOP_DOMAIN}'
+# Cross-worker single-flight: whoever SET NXes this key paginates Judge.me, the others poll Redis.
+# Uses a raw client because it needs SET NX PX and compare-and-delete, which Flask-Caching doesn't expose
+SHARED_REFRESH_LOCK_KEY = f'reviews-refresh-lock:{SHOP_DOMAIN}'
+REDIS_LOCK_CLIENT = redis.Redis.from_url(REDIS_URL, socket_timeout=CONNECT_TIMEOUT) if REDIS_URL else None
+# Short, so a crashed holder's lock lapses quickly; the holder renews it every third of this while fetching,
+# which keeps it held for however long a large shop's paginate takes at JUDGEME_RPS
+SHARED_REFRESH_LOCK_TTL = 10
+SHARED_POLL_INTERVAL = 0.25
+if REDIS_LOCK_CLIENT is not None:
+    # Both only touch the lock while it still holds the caller's token
+    RELEASE_REFRESH_LOCK = REDIS_LOCK_CLIENT.register_script(
+        "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0")
+    RENEW_REFRESH_LOCK = REDIS_LOCK_CLIENT.register_script(
+        "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0")
+
+# Result of one refresh; bodies_by_handle holds each handle's RenderedReviews, so requests only look it up.
+# The Review records themselves aren't kept: once rendered, nothing reads them again
+ReviewsSnapshot = namedtuple('ReviewsSnapshot', 'bodies_by_handle generation fetched_at')
+# The last successful refresh
+REVIEWS_SNAPSHOT = None
+REVIEWS_CACHE_LOCK = threading.Lock()
+# Single-flight: SHOP_DOMAIN -> Event set when the in-progress fetch finishes
+INFLIGHT_FETCHES = {}
+# How long a follower waits on another caller's fetch before giving up
+SINGLE_FLIGHT_TIMEOUT = 15
+# Cold-path single-flight: handle -> [Event set when the product fetch finishes, its reviews or None]
+INFLIGHT_PRODUCT_FETCHES = {}
+REFRESH_NOW = threading.Event()
+REFRESHER_STARTED = False
+
+def shared_cache_call(operation, *args):
+    """Runs a shared-cache operation, treating an unreachable Redis as a miss"""
+    try:
+        return operation(*args)
+    except Exception:
+        return None
+
+def load_shared_reviews():
+    """Another worker's (raw_reviews, generation, fetched_at) from Redis, or None"""
+    shared = shared_cache_call(cache.get, SHARED_REVIEWS_KEY)
+    if shared is None:
+        return None
+    payload = json_loads(shared)
+    return [Review(*row) for row in payload['reviews']], payload['generation'], payload['fetched_at']
+
+def acquire_refresh_lock():
+    """This worker's lock token, False if another worker holds the lock, None if Redis is unreachable"""
+    token = secrets.token_hex(8)
+    try:
+        acquired = REDIS_LOCK_CLIENT.set(SHARED_REFRESH_LOCK_KEY, token, nx=True, px=SHARED_REFRESH_LOCK_TTL * 1000)
+    except redis.RedisError:
+        return None
+    return token if acquired else False
+
+def keep_refresh_lock(token, done):
+    """Renews the lock until `done` is set, so it outlives fetches longer than its TTL"""
+    while not done.wait(SHARED_REFRESH_LOCK_TTL / 3):
+        try:
+            if not RENEW_REFRESH_LOCK(keys=[SHARED_REFRESH_LOCK_KEY], args=[token, SHARED_REFRESH_LOCK_TTL * 1000]):
+                return
+        except redis.RedisError:
+            pass
+
+def release_refresh_lock(token):
+    try:
+        RELEASE_REFRESH_LOCK(keys=[SHARED_REFRESH_LOCK_KEY], args=[token])
+    except redis.RedisError:
+        pass
+
+def fetch_and_publish_reviews():
+    """Paginates Judge.me and stores the result in the shared cache"""
+    raw_reviews = fetch_all_shop_reviews()
+    # Labels this refresh in the shared payload and debug logs; ETags hash the rendered body instead
+    generation = secrets.token_hex(8)
+    fetched_at = time.time()
+    shared_cache_call(cache.set, SHARED_REVIEWS_KEY, json_dumps({
+        # Rows of Review fields: shorter than keyed objects and rebuilt positionally on read
+        'generation': generation, 'fetched_at': fetched_at, 'reviews': [tuple(r) for r in raw_reviews]
+    }))
+    return raw_reviews, generation, fetched_at
+
+def fetch_and_share_reviews():
+    """Paginates Judge.me unless another worker is already doing so, in which case waits for its result"""
+    if REDIS_LOCK_CLIENT is None:
+        # No shared cache, so nobody to coordinate with
+        return fetch_and_publish_reviews()
+    token = acquire_refresh_lock()
+    while token is False:
+        # The holder keeps the lock alive while it fetches; once it lapses or is released, retry it
+        time.sleep(SHARED_POLL_INTERVAL)
+        shared = load_shared_reviews()
+        if shared is not None:
+            return shared
+        token = acquire_refresh_lock()
+    if token is None:
+        # An unreachable Redis can't coordinate anything, so fetch locally
+        return fetch_and_publish_reviews()
+
+    done = threading.Event()
+    threading.Thread(target=keep_refresh_lock, args=(token, done), name='reviews-lock-keepalive', daemon=True).start()
+    try:
+        return fetch_and_publish_reviews()
+    finally:
+        done.set()
+        release_refresh_lock(token)
+
+def index_reviews_by_handle(raw_reviews):
+    """Groups published reviews by product handle for O(1) lookups"""
+    index = defaultdict(list)
+    for r in raw_reviews:
+        handle = r.product_handle
+        # Reviews without a handle can never be requested, so they aren't kept
+        if handle and r.published:
+            index[handle].append(r)
+    # Plain dict: lookups for unknown handles must not insert empty entries
+    return dict(index)
+
+# Handles with fewer ratings than this count them with a plain list; numpy's setup cost dominates below it
+NUMPY_STATS_MIN = 1000
+
+def rating_array(reviews):
+    """Ratings of `reviews`: a compact int8 array for large sets when numpy is available, else a list"""
+    ratings = (r.rating for r in reviews)
+    if np is None or len(reviews) < NUMPY_STATS_MIN:
+        return list(ratings)
+    return np.fromiter(ratings, dtype=np.int8, count=len(reviews))
+
+def build_reviews_snapshot(raw_reviews, generation, fetched_at):
+    """Indexes a refresh's reviews by handle and pre-renders each handle's response body"""
+    reviews_by_handle = index_reviews_by_handle(raw_reviews)
+    # Runs on the refresher thread, so the projection and serialization stay off the request path
+    bodies_by_handle = {h: render_reviews(rs) for h, rs in reviews_by_handle.items()}
+    return ReviewsSnapshot(bodies_by_handle, generation, fetched_at)
+
+def refresh_reviews_snapshot(only_if_missing=False):
+    """Loads reviews from the shared cache or Judge.me and swaps in a new snapshot.
+
+    Concurrent callers share one fetch: the first becomes the leader, the rest wait on its Event.
+    Returns the current snapshot, or None if the cache is still cold.
+    """
+    global REVIEWS_SNAPSHOT
+    with REVIEWS_CACHE_LOCK:
+        if only_if_missing and REVIEWS_SNAPSHOT is not None:
+            return REVIEWS_SNAPSHOT
+        done = INFLIGHT_FETCHES.get(SHOP_DOMAIN)
+        is_leader = done is None
+        if is_leader:
+            done = INFLIGHT_FETCHES[SHOP_DOMAIN] = threading.Event()
+    if not is_leader:
+        done.wait(SINGLE_FLIGHT_TIMEOUT)
+        return REVIEWS_SNAPSHOT
+
+    try:
+        # Reuse another worker's fetch when there is one
+        raw_reviews, generation, fetched_at = load_shared_reviews() or fetch_and_share_reviews()
+        REVIEWS_SNAPSHOT = build_reviews_snapshot(raw_reviews, generation, fetched_at)
+        log.debug("Reviews snapshot %s: %d reviews, %d handles", generation, len(raw_reviews), len(REVIEWS_SNAPSHOT.bodies_by_handle))
+        return REVIEWS_SNAPSHOT
+    finally:
+        with REVIEWS_CACHE_LOCK:
+            del INFLIGHT_FETCHES[SHOP_DOMAIN]
+        done.set()
+
+def refresh_reviews_forever():
+    """Background loop: refreshes every REVIEWS_REFRESH_INTERVAL seconds, or sooner when REFRESH_NOW is set"""
+    failures = 0
     while True:
-        params = {
-            'api_token': API_TOKEN,
-            'shop_domain': SHOP_DOMAIN,
-            'per_page': per_page,
-            'page': page
-        }
+        REFRESH_NOW.wait(REVIEWS_REFRESH_INTERVAL)
+        REFRESH_NOW.clear()
         try:
-            res = requests.get(url, params=params)
-            if res.status_code != 200: break
-            data = res.json()
-            current_batch = data.get('reviews', [])
-            if not current_batch: break 
-            all_reviews.extend(current_batch)
-            if len(current_batch) < per_page: break
-            page += 1
-            time.sleep(0.1)
-        except:
-            break
-    return all_reviews
-
-def calculate_stats(reviews):
-    """Calculates ratings and fixes the 4.4 vs 4.39 rounding discrepancy [cite: 69, 70]"""
-    count = len(reviews)
+            refresh_reviews_snapshot()
+            failures = 0
+        except Exception as e:
+            # Keep serving the previous snapshot; the next cycle retries.
+            # No traceback: httpx errors (and any chained context) embed the URL, which carries the API token
+            log.error("Background review refresh failed (%s)", type(e).__name__)
+            # Back off, so cold requests calling warm_reviews_cache() can't turn a persistent
+            # failure (e.g. a bad token) into back-to-back full paginates
+            failures += 1
+            time.sleep(min(REVIEWS_REFRESH_INTERVAL, RETRY_BACKOFF * 2 ** failures))
+
+def start_reviews_refresher():
+    """Starts the background refresher once per process (lazily, so forked workers each get one)"""
+    global REFRESHER_STARTED
+    if REFRESHER_STARTED:
+        return
+    with REVIEWS_CACHE_LOCK:
+        if not REFRESHER_STARTED:
+            threading.Thread(target=refresh_reviews_forever, name='reviews-refresher', daemon=True).start()
+            REFRESHER_STARTED = True
+
+def warm_reviews_cache():
+    """Asks the background refresher to load the shop-wide snapshot now"""
+    start_reviews_refresher()
+    REFRESH_NOW.set()
+
+def fetch_product_reviews_once(handle):
+    """fetch_product_reviews shared by concurrent cold requests for one handle; None if it failed"""
+    with REVIEWS_CACHE_LOCK:
+        flight = INFLIGHT_PRODUCT_FETCHES.get(handle)
+        is_leader = flight is None
+        if is_leader:
+            flight = INFLIGHT_PRODUCT_FETCHES[handle] = [threading.Event(), None]
+    if not is_leader:
+        flight[0].wait(SINGLE_FLIGHT_TIMEOUT)
+        return flight[1]
+
+    try:
+        flight[1] = fetch_product_reviews(handle)
+    except UPSTREAM_ERRORS:
+        pass
+    finally:
+        with REVIEWS_CACHE_LOCK:
+            del INFLIGHT_PRODUCT_FETCHES[handle]
+        flight[0].set()
+    return flight[1]
+
+def get_all_reviews_cached():
+    """Returns the current ReviewsSnapshot, or None if the cold-start fetch timed out"""
+    start_reviews_refresher()
+    snapshot = REVIEWS_SNAPSHOT
+    if snapshot is None:
+        # Only a process's very first requests wait on Judge.me
+        snapshot = refresh_reviews_snapshot(only_if_missing=True)
+        if snapshot is None:
+            return None
+    elif time.time() - snapshot.fetched_at > REVIEWS_REFRESH_INTERVAL:
+        # The refresher fell behind (e.g. a frozen serverless instance): serve stale, wake it up
+        REFRESH_NOW.set()
+    return snapshot
+
+def invalidate_reviews_cache():
+    """Drops the shared copy and triggers an early refresh so new reviews show up promptly"""
+    shared_cache_call(cache.delete, SHARED_REVIEWS_KEY)
+    REFRESH_NOW.set()
+
+def calculate_stats(ratings):
+    """Calculates ratings and fixes the 4.4 vs 4.39 rounding discrepancy [cite: 69, 70]
+
+    `ratings` comes from rating_array, so every value is already an int in 1..5.
+    """
+    count = len(ratings)
     if count == 0:
         return {"average": 0.0, "count": 0, "distribution": {5:0, 4:0, 3:0, 2:0, 1:0}}
     
-    distribution = {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
-    total_sum = 0
-    for r in reviews:
-        rating = int(r.get('rating', 5))
-        if 1 <= rating <= 5:
-            distribution[rating] += 1
-            total_sum += rating
+    # counts[1..5] is the histogram; a list index avoids dict hashing per rating
+    if np is not None and isinstance(ratings, np.ndarray):
+        counts = np.bincount(ratings, minlength=6).tolist()
+    else:
+        counts = [0] * 6
+        for v in ratings:
+            counts[v] += 1
+    total_sum = counts[1] + 2 * counts[2] + 3 * counts[3] + 4 * counts[4] + 5 * counts[5]
             
     # ROUNDING FIX: Ensures consistency for frontend display 
     return {
         "average": round(total_sum / count, 2),
         "count": count,
-        "distribution": distribution
+        "distribution": {5: counts[5], 4: counts[4], 3: counts[3], 2: counts[2], 1: counts[1]}
+    }
+
+def clean_review(r):
+    """The storefront's shape of a Review"""
+    return {
+        "id": r.id,
+        "body": r.body,
+        "rating": r.rating,
+        "author": r.author,
+        "is_verified": r.is_verified,
+        "media": r.media,
+        "date": r.created_at
     }
 
+def render_reviews_body(reviews):
+    """Serializes the /api/product-reviews payload for one handle's published reviews"""
+    clean_reviews = [clean_review(r) for r in reviews]
+    return json_dumps({"stats": calculate_stats(rating_array(reviews)), "reviews": clean_reviews})
+
+# One handle's serialized body, its content ETag and (when worth it) a gzipped copy, all built at cache fill
+RenderedReviews = namedtuple('RenderedReviews', 'etag body gzipped')
+
+def render_reviews(reviews):
+    """Renders, fingerprints and pre-compresses one handle's response"""
+    body = render_reviews_body(reviews)
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    # Compressed once per refresh instead of once per request; tiny bodies aren't worth it
+    gzipped = gzip.compress(body, mtime=0) if len(body) >= app.config['COMPRESS_MIN_SIZE'] else None
+    return RenderedReviews(etag, body, gzipped)
+
+# Response for handles without any published reviews
+EMPTY_REVIEWS = render_reviews([])
+
+def json_response(payload, status=200):
+    """Replacement for jsonify using the fastest available JSON encoder"""
+    body = json_dumps(payload)
+    return app.response_class(body, status=status, mimetype='application/json')
+
 # --- API ROUTES ---
 
 @app.route('/api/submit-review', methods=['POST'])
@@ -98,13 +782,13 @@ def submit_review_route():
     """Submits a product-specific review to Judge.me"""
     data = request.json
     if not data:
-        return jsonify({"error": "No data provided"}), 400
+        return json_response({"error": "No data provided"}), 400
 
     handle = data.get('handle', 'version-h1')
     external_id = PRODUCT_ID_MAP.get(handle)
     
     if not external_id:
-        return jsonify({"error": f"Product ID missing for handle: {handle}"}), 404
+        return json_response({"error": f"Product ID missing for handle: {handle}"}), 404
 
     # Build Payload according to Judge.me API Doc schema
     judgeme_payload = {
@@ -120,61 +804,98 @@ def submit_review_route():
         "ip_addr": data.get("ip_addr", request.remote_addr)
     }
 
-    endpoint = "https://judge.me/api/v1/reviews"
+    endpoint = f"{JUDGEME_API}/reviews"
     try:
-        response = requests.post(
+        # A shopper is waiting, so the POST doesn't queue behind background pagination; it still
+        # takes its token, and the refresh's next pages absorb the delay
+        JUDGEME_RATE_LIMIT.take()
+        response = SESSION.post(
             f"{endpoint}?api_token={API_TOKEN}",
-            json=judgeme_payload
+            json=judgeme_payload,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
         )
 
         if response.status_code in [200, 201]:
-            return jsonify({"status": "success", "message": "Review linked to product"}), 200
+            invalidate_reviews_cache()
+            return json_response({"status": "success", "message": "Review linked to product"}), 200
         else:
-            return jsonify({"status": "error", "message": response.text}), response.status_code
+            return json_response({"status": "error", "message": response.text}), response.status_code
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        # requests errors embed the URL (and with it the API token), so only the type is reported
+        log.error("Judge.me review submission failed (%s)", type(e).__name__)
+        return json_response({"status": "error", "message": "Could not reach Judge.me"}), 500
+
+@app.route('/api/_invalidate', methods=['POST'])
+def invalidate_cache_route():
+    """Internal: forces the next review read to refetch from Judge.me"""
+    # Each call costs a full re-paginate, so only holders of INVALIDATE_TOKEN may trigger it
+    token = request.headers.get('X-Invalidate-Token', '')
+    if not INVALIDATE_TOKEN or not secrets.compare_digest(token.encode(), INVALIDATE_TOKEN.encode()):
+        return json_response({"error": "Forbidden"}), 403
+    invalidate_reviews_cache()
+    return json_response({"status": "success"}), 200
+
+@app.route('/healthz', methods=['GET'])
+def healthz_route():
+    """Reports whether the review cache is loaded and fresh"""
+    snapshot = REVIEWS_SNAPSHOT
+    if snapshot is None:
+        # Readiness probes may hold back all traffic until this passes, so the probe itself starts the load
+        warm_reviews_cache()
+        return json_response({"status": "cold", "age_seconds": None}), 503
+    age = round(time.time() - snapshot.fetched_at, 1)
+    if age > REVIEWS_STALE_AFTER:
+        warm_reviews_cache()
+        return json_response({"status": "stale", "age_seconds": age}), 503
+    return json_response({"status": "ok", "age_seconds": age}), 200
 
 @app.route('/api/product-reviews', methods=['GET'])
 def get_reviews_route():
     """Fetches reviews and fixes the name display issue (e.g., 'I.Y' vs Full Name)"""
     target_handle = request.args.get('handle')
     if not target_handle:
-        return jsonify({"error": "Missing handle"}), 400
+        return json_response({"error": "Missing handle"}), 400
 
-    raw_reviews = fetch_all_shop_reviews()
-    
-    # Filter reviews by product handle and published status
-    filtered_reviews = [r for r in raw_reviews if r.get('product_handle') == target_handle and r.get('published') is True]
-    stats = calculate_stats(filtered_reviews)
-    
-    clean_reviews = []
-    for r in filtered_reviews:
-        media = []
-        # Process Images
-        if r.get('pictures'):
-            for p in r['pictures']:
-                url = p.get('urls', {}).get('original') if isinstance(p, dict) else None
-                if url: media.append({"type": "image", "url": url})
-        
-        # FIX: Prioritize raw 'user_name' to prevent initials (e.g. 'I.Y') from showing 
-        author_name = r.get('user_name') or r.get('reviewer', {}).get('name') or 'Verified Buyer'
-        if author_name.strip().lower() == 'anonymous':
-            author_name = "Verified Buyer"
-
-        clean_reviews.append({
-            "id": r.get('id'),
-            "body": r.get('body'),
-            "rating": int(r.get('rating', 5)),
-            "author": author_name,
-            "is_verified": r.get('verified') in ['buyer', 'verified_buyer', 'email'],
-            "media": media,
-            "date": r.get('created_at')
-        })
-
-    return jsonify({
-        "stats": stats,
-        "reviews": clean_reviews
-    })
+    if REVIEWS_SNAPSHOT is None:
+        # Cold process: answer from this product's reviews alone while the full shop loads in the background
+        warm_reviews_cache()
+        product_reviews = fetch_product_reviews_once(target_handle)
+        if product_reviews is not None:
+            # The handle check guards against Judge.me ignoring or mis-resolving product_id
+            published = [r for r in product_reviews if r.published and r.product_handle == target_handle]
+            response = app.response_class(render_reviews_body(published), mimetype='application/json')
+            response.headers['Cache-Control'] = REVIEWS_CACHE_CONTROL
+            return response
+
+    try:
+        snapshot = get_all_reviews_cached()
+    except UPSTREAM_ERRORS:
+        return json_response({"error": "Could not load reviews from Judge.me"}), 502
+    if snapshot is None:
+        return json_response({"error": "Reviews are still loading, please retry"}), 503
+    # Pre-rendered on cache refresh, so serving is a dict lookup
+    rendered = snapshot.bodies_by_handle.get(target_handle, EMPTY_REVIEWS)
+
+    # The ETag hashes the body, so it survives refreshes that changed nothing for this handle.
+    # Weak, since the identity and compressed encodings share it
+    if request.if_none_match.contains_weak(rendered.etag):
+        not_modified = app.response_class(status=304)
+        not_modified.set_etag(rendered.etag, weak=True)
+        not_modified.headers['Cache-Control'] = REVIEWS_CACHE_CONTROL
+        not_modified.vary.add('Accept-Encoding')
+        return not_modified
+
+    if rendered.gzipped is not None and request.accept_encodings['gzip']:
+        # Already encoded, so Flask-Compress passes it through untouched
+        response = app.response_class(rendered.gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(rendered.body, mimetype='application/json')
+    response.set_etag(rendered.etag, weak=True)
+    response.headers['Cache-Control'] = REVIEWS_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Local development only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(debug=os.getenv('FLASK_ENV') == 'development', port=5000)
\ No newline at end of file
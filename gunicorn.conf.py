@@ -0,0 +1,14 @@
+# Production server: gunicorn -c gunicorn.conf.py app:app
+# gevent workers yield during Judge.me I/O, so one worker serves many concurrent requests.
+# The gevent worker monkey-patches the stdlib (sockets, threading) before app.py is imported.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+worker_class = 'gevent'
+worker_connections = 1000
+
+def on_starting(server):
+    # Inherited by the workers, which split JUDGEME_RPS between them (see JUDGEME_RATE_LIMIT in app.py);
+    # read from the final config so a -w flag counts too
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)